@@ -13,6 +13,7 @@ Cron Jobs Implemented:
 3. scan_secrets_daily() - Daily at 1:00 AM
 4. rotate_keys_monthly() - Monthly on 1st at 4:00 AM
 5. generate_compliance_reports() - Weekly on Sunday at 5:00 AM
+6. update_activity_baselines_daily() - Daily
 
 Author: Claude (AI Assistant)
 Date: October 25, 2025
@@ -29,6 +30,9 @@ from typing import Dict, List, Any, Optional
 from ai_assistant.core import analytics_orm as analytics
 from ai_assistant.core import security as security_core
 
+# Snippets with findings persisted per bulk write in scan_secrets_daily
+SECRET_SCAN_COMMIT_BATCH = 100
+
 
 # ============================================================================
 # WEEK 9: ANALYTICS CRON JOBS
@@ -366,8 +370,10 @@ def scan_secrets_daily():
 
     What it does:
     - Scans last 24 hours of code interactions
+    - Scans each unique snippet once (content-hash dedup, cached across days)
+    - Shards new snippets across worker processes (see security_core.scan_secrets_parallel)
     - Detects common secret patterns (AWS keys, GitHub tokens, etc.)
-    - Creates security incidents for detected secrets
+    - Creates security incidents for detected secrets, merging repeats of an open one
     - Sends alerts to affected users
     - Logs all findings in Security Audit Log
 
@@ -402,8 +408,10 @@ def scan_secrets_daily():
 
         frappe.logger().info(f"Found {len(code_events)} code submission events")
 
-        secrets_found = 0
-        incidents_created = 0
+        # Group submissions by content hash so identical snippets are scanned once.
+        # Parsed metadata is memoized because retries resubmit the same payload.
+        submissions = {}
+        parsed_metadata = {}
 
         for event in code_events:
             try:
@@ -411,90 +419,77 @@ def scan_secrets_daily():
                 if not event.metadata:
                     continue
 
-                metadata = json.loads(event.metadata) if isinstance(event.metadata, str) else event.metadata
+                if isinstance(event.metadata, str):
+                    metadata = parsed_metadata.get(event.metadata)
+                    if metadata is None:
+                        metadata = parsed_metadata[event.metadata] = json.loads(event.metadata)
+                else:
+                    metadata = event.metadata
                 code = metadata.get('code', '')
 
-                if not code:
+                if not code or security_core.is_secret_scan_allowlisted_path(metadata.get('file_path')):
                     continue
 
-                # Scan for secrets using security_core module
-                scan_result = security_core.scan_secrets(
-                    code=code,
-                    file_path=metadata.get('file_path')
-                )
-
-                if not scan_result.get('success'):
-                    continue
-
-                secrets = scan_result.get('secrets', [])
-
-                if len(secrets) > 0:
-                    secrets_found += len(secrets)
-
-                    # Create security incident
-                    for secret in secrets:
-                        try:
-                            incident = frappe.get_doc({
-                                'doctype': 'Security Incident',
-                                'incident_type': 'secret_exposure',
-                                'severity': secret.get('severity', 'high'),
-                                'title': f"Hardcoded {secret.get('type')} detected",
-                                'description': f"""
-Detected {secret.get('type')} in code submission.
-
-File: {metadata.get('file_path', 'unknown')}
-Line: {secret.get('line_number', 'N/A')}
-Pattern: {secret.get('pattern_matched', 'N/A')}
-
-Recommendation: Remove the hardcoded secret and use environment variables instead.
-                                """.strip(),
-                                'affected_users': json.dumps([event.user_id]),
-                                'affected_resources': json.dumps([{
-                                    'type': 'code_submission',
-                                    'event_id': event.name
-                                }]),
-                                'detection_method': 'automated_scan',
-                                'status': 'open',
-                                'assigned_to': event.user_id,
-                                'priority': 'high' if secret.get('severity') == 'critical' else 'medium'
-                            })
-                            incident.insert(ignore_permissions=True)
-                            incidents_created += 1
-
-                            # Log audit event
-                            security_core.log_audit_event(
-                                action='secret_detected',
-                                resource_type='code_submission',
-                                resource_id=event.name,
-                                user_id=event.user_id,
-                                details=json.dumps({
-                                    'secret_type': secret.get('type'),
-                                    'severity': secret.get('severity'),
-                                    'incident_id': incident.name
-                                }),
-                                risk_level='high',
-                                ip_address=None
-                            )
-
-                            frappe.logger().info(
-                                f"Created incident for {secret.get('type')} "
-                                f"found in {event.user_id}'s code"
-                            )
-
-                        except Exception as e:
-                            frappe.logger().error(
-                                f"Failed to create incident for secret: {str(e)}"
-                            )
-                            continue
+                cache_key = security_core.secret_scan_cache_key(code)
+                submission = submissions.setdefault(cache_key, {'code': code, 'events': []})
+                submission['events'].append((event, metadata))
 
             except Exception as e:
                 frappe.logger().error(
-                    f"Failed to scan event {event.name}: {str(e)}"
+                    f"Failed to parse event {event.name}: {str(e)}"
                 )
                 continue
 
-        frappe.db.commit()
+        frappe.logger().info(f"Found {len(submissions)} unique code snippets")
+
+        secrets_found = 0
+        incidents_created = 0
+        cached_scans = 0
+        failed_scans = 0
+        pending = []
+
+        def flush():
+            nonlocal secrets_found, incidents_created
+            found, created = _record_secret_scans(pending)
+            secrets_found += found
+            incidents_created += created
+            pending.clear()
+            frappe.db.commit()
+
+        def process(cache_key, findings):
+            if findings:
+                pending.append((submissions[cache_key]['events'], findings))
+
+            # Persist in batches rather than once per snippet or finding
+            if len(pending) >= SECRET_SCAN_COMMIT_BATCH:
+                flush()
+
+        # Results from previous runs (or other days) are reused without rescanning
+        to_scan = []
+        for cache_key, submission in submissions.items():
+            findings = security_core.get_cached_secret_scan(cache_key)
+            if findings is None:
+                to_scan.append((cache_key, submission['code']))
+            else:
+                cached_scans += 1
+                process(cache_key, findings)
+
+        # Only new content reaches the regex engine, sharded across worker processes
+        for cache_key, findings, error in security_core.scan_secrets_parallel(to_scan):
+            if error:
+                failed_scans += 1
+                frappe.logger().error(f"Failed to scan snippet {cache_key}: {error}")
+                continue
+
+            security_core.cache_secret_scan(cache_key, findings)
+            process(cache_key, findings)
+
+        flush()
 
+        frappe.logger().info(
+            f"Scanned {len(to_scan)} new snippets, reused {cached_scans} cached results, "
+            f"{failed_scans} failed."
+        )
         frappe.logger().info(f"Scan complete. Found {secrets_found} secrets.")
         frappe.logger().info(f"Created {incidents_created} security incidents.")
         frappe.logger().info("=" * 80)
@@ -510,20 +505,113 @@ Recommendation: Remove the hardcoded secret and use environment variables instea
         raise
 
 
+def _record_secret_scans(batch: List):
+    """
+    Persist a batch of scanned snippets with bulk inserts.
+
+    batch holds (events, findings) per unique snippet. Detection records are
+    written once per file path (deduplicated by security_core). Incidents are
+    correlated by security_core on (file path, secret content), so the same
+    secret pasted again while its incident is open raises that incident's
+    occurrence count instead of opening another one. Audit events are created
+    per submitting event. Returns (secrets_found, incidents_created).
+    """
+    if not batch:
+        return 0, 0
+
+    # One detection write for every distinct (snippet, file path)
+    file_batch = []
+    file_index = {}
+    for i, (events, findings) in enumerate(batch):
+        for event, metadata in events:
+            key = (i, metadata.get('file_path'))
+            if key not in file_index:
+                file_index[key] = len(file_batch)
+                file_batch.append((metadata.get('file_path'), findings))
+
+    recorded = security_core.record_secret_findings_batch(file_batch, commit=False)
+
+    now = now_datetime()
+    secrets_found = 0
+    incidents = []
+    audit_events = []
+
+    for i, (events, findings) in enumerate(batch):
+        for event, metadata in events:
+            file_path = metadata.get('file_path')
+            secrets = recorded[file_index[(i, file_path)]]
+            secrets_found += len(secrets)
+
+            for secret in secrets:
+                incidents.append({
+                    'title': f"Hardcoded {secret.get('secret_type')} detected",
+                    'description': f"""
+Detected {secret.get('secret_type')} in code submission.
+
+File: {file_path or 'unknown'}
+Line: {secret.get('line_number', 'N/A')}
+Pattern: {secret.get('pattern', 'N/A')}
+
+Recommendation: Remove the hardcoded secret and use environment variables instead.
+                    """.strip(),
+                    'incident_type': 'secret_exposure',
+                    'severity': secret.get('severity', 'high'),
+                    'impact': 'high' if secret.get('severity') == 'critical' else 'medium',
+                    'detected_at': now,
+                    'reported_by': 'Administrator',
+                    'resource': file_path or '',
+                    'content_hash': secret.get('content_hash') or secret.get('fingerprint'),
+                    'affected_users': [event.user_id],
+                    'affected_resources': [f"code_submission:{event.name}"]
+                })
+
+                audit_events.append({
+                    'event_type': 'create',
+                    'event_category': 'security',
+                    'action': 'secret_detected',
+                    'resource_type': 'code_submission',
+                    'resource_id': event.name,
+                    'user_id': event.user_id,
+                    'metadata': {
+                        'secret_id': secret.get('secret_id'),
+                        'secret_type': secret.get('secret_type'),
+                        'severity': secret.get('severity')
+                    },
+                    'risk_level': 'high',
+                    'compliance_relevant': True
+                })
+
+    results = security_core.record_incidents(incidents, commit=False)
+    for audit_event, result in zip(audit_events, results):
+        audit_event['metadata']['incident_id'] = result['incident_id']
+    if audit_events:
+        security_core.log_audit_events(audit_events, commit=False)
+
+    incidents_created = sum(1 for result in results if result['is_new'])
+    frappe.logger().info(
+        f"Recorded {secrets_found} secrets, {incidents_created} new incidents and "
+        f"{len(results) - incidents_created} repeats for {len(batch)} snippets"
+    )
+
+    return secrets_found, incidents_created
+
+
 def rotate_keys_monthly():
     """
-    Rotate API keys and encryption keys on a monthly basis.
+    Rotate encryption keys on a monthly basis.
 
     Schedule: Monthly on 1st at 4:00 AM
-    Purpose: Maintain security by rotating long-lived credentials
-    Runtime: ~5-10 minutes
+    Purpose: Maintain security by rotating long-lived data keys
+    Runtime: ~1 minute (re-encryption continues in the background)
 
     What it does:
-    - Identifies keys older than 30 days
-    - Generates new keys
-    - Updates key rotation records
-    - Sends notifications to key owners
-    - Archives old keys (with grace period)
+    - Identifies key types whose active data key is older than KEY_ROTATION_DAYS
+    - Generates a new wrapped data key for each and retires the old one
+    - Records an audit event per rotation
+    - Queues lazy re-encryption of registered columns onto the new keys
+
+    Old keys stay readable, so nothing is unavailable while data is
+    re-encrypted.
 
     Registered in hooks.py as:
     scheduler_events = {
@@ -537,65 +625,39 @@ def rotate_keys_monthly():
         frappe.logger().info("CRON JOB: rotate_keys_monthly - STARTED")
         frappe.logger().info("=" * 80)
 
-        # Get current date
-        today = now_datetime().date()
-        rotation_threshold = add_days(today, -30)
+        rotation_threshold = add_days(now_datetime(), -security_core.KEY_ROTATION_DAYS)
 
-        frappe.logger().info(f"Rotating keys older than {rotation_threshold}")
+        frappe.logger().info(f"Rotating keys created before {rotation_threshold}")
 
-        # Get all active API keys that need rotation
-        # Note: This assumes there's a Security API Key DocType
-        old_keys = frappe.get_all(
-            'Security API Key',
-            filters={
-                'status': 'active',
-                'last_rotated': ['<', rotation_threshold]
-            },
-            fields=['name', 'user_id', 'key_type', 'last_rotated']
-        )
+        due_key_types = sorted({
+            row.key_type for row in frappe.get_all(
+                'Oropendola Encryption Key',
+                filters={
+                    'status': 'active',
+                    'key_type': ['!=', 'master'],
+                    'created_at': ['<', rotation_threshold]
+                },
+                fields=['key_type']
+            )
+        })
 
-        frappe.logger().info(f"Found {len(old_keys)} keys to rotate")
+        frappe.logger().info(f"Found {len(due_key_types)} key types to rotate")
 
         rotated_count = 0
 
-        for key_record in old_keys:
-            try:
-                # Call rotate_key function from security_core
-                result = security_core.rotate_key(
-                    key_id=key_record.name,
-                    reason='scheduled_rotation'
-                )
+        for key_type in due_key_types:
+            # rotate_keys commits, audits and queues re-encryption itself
+            result = security_core.rotate_keys(key_type)
 
-                if result.get('success'):
-                    rotated_count += 1
-
-                    # Log audit event
-                    security_core.log_audit_event(
-                        action='key_rotated',
-                        resource_type='api_key',
-                        resource_id=key_record.name,
-                        user_id=key_record.user_id,
-                        details=json.dumps({
-                            'key_type': key_record.key_type,
-                            'rotation_reason': 'scheduled_rotation',
-                            'old_last_rotated': str(key_record.last_rotated),
-                            'new_key_id': result.get('new_key_id')
-                        }),
-                        risk_level='low',
-                        ip_address=None
-                    )
-
-                    frappe.logger().info(
-                        f"Rotated key {key_record.name} for user {key_record.user_id}"
-                    )
-
-            except Exception as e:
+            if result.get('success'):
+                rotated_count += 1
+                frappe.logger().info(
+                    f"Rotated {key_type} key {result.get('old_key_id')} -> {result.get('new_key_id')}"
+                )
+            else:
                 frappe.logger().error(
-                    f"Failed to rotate key {key_record.name}: {str(e)}"
+                    f"Failed to rotate {key_type} key: {result.get('message')}"
                 )
-                continue
-
-        frappe.db.commit()
 
         frappe.logger().info(f"Rotated {rotated_count} keys")
         frappe.logger().info("=" * 80)
@@ -603,9 +665,11 @@ def rotate_keys_monthly():
         frappe.logger().info("=" * 80)
 
     except Exception as e:
-        # This is expected to fail if Security API Key DocType doesn't exist yet
-        frappe.logger().warning(f"CRON JOB SKIPPED: rotate_keys_monthly - {str(e)}")
-        frappe.logger().info("Note: This job requires Security API Key DocType to be created")
+        frappe.logger().error(f"CRON JOB FAILED: rotate_keys_monthly - {str(e)}")
+        frappe.log_error(
+            title="Cron Job Failed: rotate_keys_monthly",
+            message=str(e)
+        )
 
 
 def generate_compliance_reports():
@@ -641,10 +705,13 @@ def generate_compliance_reports():
 
         frappe.logger().info(f"Generating compliance reports for {start_date} to {end_date}")
 
-        # Compliance frameworks to generate reports for
-        frameworks = ['SOC2', 'GDPR', 'HIPAA', 'ISO27001', 'PCI-DSS']
+        # Compute every framework's controls from one set of aggregates; the
+        # per-framework reports below read the cached evaluation
+        security_core.evaluate_compliance(str(start_date), str(end_date), refresh=True)
+        frameworks = list(security_core.FRAMEWORK_CONTROLS)
 
         reports_generated = 0
+        audit_events = []
 
         for framework in frameworks:
             try:
@@ -662,27 +729,29 @@ def generate_compliance_reports():
 
                     report_id = report.get('report_id')
                     score = report.get('compliance_score', 0)
+                    findings = report.get('findings', {})
 
                     frappe.logger().info(
                         f"{framework} report generated: {report_id} (Score: {score}%)"
                     )
 
-                    # Log audit event
-                    security_core.log_audit_event(
-                        action='compliance_report_generated',
-                        resource_type='compliance_report',
-                        resource_id=report_id,
-                        user_id='system',
-                        details=json.dumps({
+                    audit_events.append({
+                        'event_type': 'create',
+                        'event_category': 'compliance',
+                        'action': 'compliance_report_generated',
+                        'resource_type': 'compliance_report',
+                        'resource_id': report_id,
+                        'user_id': 'Administrator',
+                        'metadata': {
                             'framework': framework,
                             'period_start': str(start_date),
                             'period_end': str(end_date),
                             'compliance_score': score,
-                            'findings_count': len(report.get('findings', []))
-                        }),
-                        risk_level='low',
-                        ip_address=None
-                    )
+                            'findings_count': sum(findings.values())
+                        },
+                        'risk_level': 'low',
+                        'compliance_relevant': True
+                    })
 
                     # If compliance score is low, create an alert
                     if score < 80:
@@ -690,19 +759,15 @@ def generate_compliance_reports():
                             f"Low compliance score for {framework}: {score}%"
                         )
 
-                        # Could create a security incident here
-                        # incident = frappe.get_doc({
-                        #     'doctype': 'Security Incident',
-                        #     'incident_type': 'compliance_violation',
-                        #     ...
-                        # })
-
             except Exception as e:
                 frappe.logger().error(
                     f"Failed to generate {framework} report: {str(e)}"
                 )
                 continue
 
+        if audit_events:
+            security_core.log_audit_events(audit_events, commit=False)
+
         frappe.db.commit()
 
         frappe.logger().info(f"Generated {reports_generated}/{len(frameworks)} compliance reports")
@@ -719,6 +784,44 @@ def generate_compliance_reports():
         raise
 
 
+def update_activity_baselines_daily():
+    """
+    Fold the previous day's per-user activity into the anomaly baselines.
+
+    Schedule: Daily (default daily time)
+    Purpose: Keep detect_anomaly an O(1) lookup against precomputed baselines
+    Runtime: seconds; one pass over yesterday's hourly activity counts
+
+    What it does:
+    - Reads yesterday's hourly counts kept by the audit writer
+    - Updates each user's EWMA mean/variance and hour-of-day profile
+    - Catches up on any days missed since the last run
+
+    Registered in hooks.py as:
+    scheduler_events = {
+        "daily": [
+            "ai_assistant.cron_jobs.update_activity_baselines_daily"
+        ]
+    }
+    """
+    try:
+        frappe.logger().info("CRON JOB: update_activity_baselines_daily - STARTED")
+
+        security_core.flush_audit_buffer()
+        result = security_core.update_activity_baselines()
+        if not result.get('success'):
+            raise Exception(result.get('message'))
+
+        frappe.logger().info(
+            f"Folded {result['days_folded']} days into {result['users']} user baselines"
+        )
+        frappe.logger().info("CRON JOB: update_activity_baselines_daily - COMPLETED")
+
+    except Exception as e:
+        frappe.logger().error(f"CRON JOB FAILED: update_activity_baselines_daily - {str(e)}")
+        raise
+
+
 # ============================================================================
 # LEGACY CLEANUP (Keep for backward compatibility)
 # ============================================================================
@@ -783,6 +886,11 @@ def get_cron_job_status() -> Dict[str, Any]:
                 'last_run': None,
                 'status': 'enabled'
             },
+            'update_activity_baselines_daily': {
+                'schedule': 'daily',
+                'last_run': None,
+                'status': 'enabled'
+            },
             'rotate_keys_monthly': {
                 'schedule': 'monthly',
                 'last_run': None,
@@ -816,6 +924,7 @@ def run_all_cron_jobs(skip_errors: bool = True):
         ('aggregate_daily_metrics', aggregate_daily_metrics),
         ('generate_weekly_insights', generate_weekly_insights),
         ('scan_secrets_daily', scan_secrets_daily),
+        ('update_activity_baselines_daily', update_activity_baselines_daily),
         ('rotate_keys_monthly', rotate_keys_monthly),
         ('generate_compliance_reports', generate_compliance_reports)
     ]
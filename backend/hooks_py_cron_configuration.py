@@ -35,6 +35,14 @@ scheduler_events = {
         # Week 12 Security: Scan for hardcoded secrets
         # Runs at: 1:00 AM (default daily time)
         "ai_assistant.cron_jobs.scan_secrets_daily",
+
+        # Week 12 Security: Fold yesterday's activity into anomaly baselines
+        # Runs at: default daily time
+        "ai_assistant.cron_jobs.update_activity_baselines_daily",
+
+        # Week 12 Security: Resume re-encryption onto the active data keys
+        # Runs at: default daily time (no-op once every column is current)
+        "ai_assistant.core.security.reencrypt_stale_ciphertexts",
     ],
 
     # ========================================================================
@@ -54,7 +62,7 @@ scheduler_events = {
     # MONTHLY JOBS
     # ========================================================================
     "monthly": [
-        # Week 12 Security: Rotate API keys and encryption keys
+        # Week 12 Security: Rotate encryption keys due for rotation
         # Runs on: 1st of month at 4:00 AM (default monthly time)
         "ai_assistant.cron_jobs.rotate_keys_monthly",
     ],
@@ -92,6 +100,30 @@ scheduler_events = {
     # }
 }
 
+# ============================================================================
+# REQUEST / JOB HOOKS
+# ============================================================================
+
+# Audit events are buffered per site within each process and sealed in
+# hash-chained batches. The buffer lives in the web or worker process that
+# logged the events, so only that process can flush it: do so when a request
+# or background job finishes so events are not held until the buffer fills up.
+
+after_request = ["ai_assistant.core.security.flush_audit_buffer"]
+after_job = ["ai_assistant.core.security.flush_audit_buffer"]
+
+# The policy index is held per process and reloaded when a policy changes.
+# Building it before the first request keeps policy lookups off the DB on the
+# hot path.
+
+before_request = ["ai_assistant.core.security.warm_policy_index"]
+before_job = ["ai_assistant.core.security.warm_policy_index"]
+
+# Data keys for envelope encryption are created as an explicit setup step,
+# never on the encrypt path (which must not commit the caller's transaction).
+
+after_migrate = ["ai_assistant.core.security.ensure_data_keys"]
+
 # ============================================================================
 # FULL EXAMPLE hooks.py
 # ============================================================================
@@ -117,6 +117,34 @@ def security_detect_anomaly(user_id):
     return result
 
 
+@frappe.whitelist()
+def security_detect_anomalies_bulk(anomalies_only=True, limit=1000):
+    """Score all users active today for anomalous behavior"""
+    from ai_assistant.core.security import detect_anomalies_bulk
+
+    if isinstance(anomalies_only, str):
+        anomalies_only = anomalies_only.lower() in ["true", "1", "yes"]
+    if isinstance(limit, str):
+        limit = int(limit)
+
+    result = detect_anomalies_bulk(anomalies_only=anomalies_only, limit=limit)
+    return result
+
+
+@frappe.whitelist()
+def security_verify_audit_chain(from_sequence=1, limit=1000):
+    """Verify the audit log hash chain"""
+    from ai_assistant.core.security import verify_audit_chain
+
+    if isinstance(from_sequence, str):
+        from_sequence = int(from_sequence)
+    if isinstance(limit, str):
+        limit = int(limit)
+
+    result = verify_audit_chain(from_sequence=from_sequence, limit=limit)
+    return result
+
+
 # ==================== POLICY MANAGEMENT APIS ====================
 
 @frappe.whitelist()
@@ -189,6 +217,49 @@ def security_evaluate_policy(policy_id, context):
     return result
 
 
+@frappe.whitelist()
+def security_evaluate_policies(scope, context, policy_type=None):
+    """Evaluate all policies in a scope"""
+    from ai_assistant.core.security import evaluate_policies
+
+    if isinstance(context, str):
+        context = json.loads(context)
+
+    result = evaluate_policies(scope, context, policy_type=policy_type)
+    return result
+
+
+@frappe.whitelist()
+def security_backtest_policies(policy_ids=None, policy_config=None, days=90, shard_days=7):
+    """Backtest policies against past audit logs"""
+    from ai_assistant.core.security import backtest_policies
+
+    if isinstance(policy_ids, str):
+        policy_ids = json.loads(policy_ids) if policy_ids else None
+    if isinstance(policy_config, str):
+        policy_config = json.loads(policy_config) if policy_config else None
+    if isinstance(days, str):
+        days = int(days)
+    if isinstance(shard_days, str):
+        shard_days = int(shard_days)
+
+    result = backtest_policies(
+        policy_ids=policy_ids,
+        policy_config=policy_config,
+        days=days,
+        shard_days=shard_days
+    )
+    return result
+
+
+@frappe.whitelist()
+def security_get_policy_backtest(run_id):
+    """Get backtest progress and results"""
+    from ai_assistant.core.security import get_policy_backtest
+    result = get_policy_backtest(run_id)
+    return result
+
+
 @frappe.whitelist()
 def security_check_compliance(framework, control_id=None):
     """Check compliance"""
@@ -234,6 +305,18 @@ def security_check_permission(subject_type, subject_id, resource_type, resource_
     return result
 
 
+@frappe.whitelist()
+def security_check_permissions_batch(checks):
+    """Check many permissions at once"""
+    from ai_assistant.core.security import check_permissions_batch
+
+    if isinstance(checks, str):
+        checks = json.loads(checks)
+
+    result = check_permissions_batch(checks)
+    return result
+
+
 @frappe.whitelist()
 def security_grant_permission(
     subject_type,
@@ -290,6 +373,22 @@ def security_get_user_permissions(user_id):
     return result
 
 
+@frappe.whitelist()
+def security_add_subject_membership(member_type, member_id, parent_type, parent_id):
+    """Add a user, group or role to a group or role"""
+    from ai_assistant.core.security import add_subject_membership
+    result = add_subject_membership(member_type, member_id, parent_type, parent_id)
+    return result
+
+
+@frappe.whitelist()
+def security_remove_subject_membership(member_type, member_id, parent_type, parent_id):
+    """Remove a user, group or role from a group or role"""
+    from ai_assistant.core.security import remove_subject_membership
+    result = remove_subject_membership(member_type, member_id, parent_type, parent_id)
+    return result
+
+
 @frappe.whitelist()
 def security_get_resource_permissions(resource_type, resource_id):
     """Get resource permissions"""
@@ -320,6 +419,18 @@ def security_scan_secrets(code, file_path=None):
     return result
 
 
+@frappe.whitelist()
+def security_scan_diff_secrets(diff, persist=True):
+    """Scan the added lines of a unified diff for secrets"""
+    from ai_assistant.core.security import scan_diff_secrets
+
+    if isinstance(persist, str):
+        persist = persist.lower() in ["true", "1", "yes"]
+
+    result = scan_diff_secrets(diff, persist=persist)
+    return result
+
+
 @frappe.whitelist()
 def security_get_detected_secrets(file_path=None, status="detected"):
     """Get detected secrets"""
@@ -391,6 +502,25 @@ def security_schedule_compliance_audit(framework, frequency):
     return result
 
 
+@frappe.whitelist()
+def security_get_compliance_evidence(framework, control_id=None, start_date=None, end_date=None, cursor=None, limit=100):
+    """Page through compliance evidence"""
+    from ai_assistant.core.security import get_compliance_evidence
+
+    if isinstance(limit, str):
+        limit = int(limit)
+
+    result = get_compliance_evidence(
+        framework,
+        control_id=control_id,
+        start_date=start_date,
+        end_date=end_date,
+        cursor=cursor,
+        limit=limit
+    )
+    return result
+
+
 # ==================== INCIDENT MANAGEMENT APIS ====================
 
 @frappe.whitelist()
@@ -402,7 +532,8 @@ def security_create_incident(
     impact="medium",
     detected_at=None,
     affected_users=None,
-    affected_resources=None
+    affected_resources=None,
+    content_hash=None
 ):
     """Create security incident"""
     from ai_assistant.core.security import create_incident
@@ -420,7 +551,8 @@ def security_create_incident(
         impact=impact,
         detected_at=detected_at,
         affected_users=affected_users,
-        affected_resources=affected_resources
+        affected_resources=affected_resources,
+        content_hash=content_hash
     )
     return result
 
@@ -464,6 +596,28 @@ def security_list_incidents(status=None, severity=None, limit=50):
     return result
 
 
+@frappe.whitelist()
+def security_get_incident_queue(status=None, severity=None, cursor=None, limit=50):
+    """Page through the incident triage queue"""
+    from ai_assistant.core.security import get_incident_queue
+
+    if isinstance(status, str) and status.startswith("["):
+        status = json.loads(status)
+    if isinstance(limit, str):
+        limit = int(limit)
+
+    result = get_incident_queue(status=status, severity=severity, cursor=cursor, limit=limit)
+    return result
+
+
+@frappe.whitelist()
+def security_get_incident_details(incident_id):
+    """Get an incident with its affected users and resources"""
+    from ai_assistant.core.security import get_incident_details
+    result = get_incident_details(incident_id)
+    return result
+
+
 # ==================== ADDITIONAL SECURITY APIS ====================
 
 @frappe.whitelist()
@@ -475,13 +629,37 @@ def security_encrypt_data(data, key_type="data"):
 
 
 @frappe.whitelist()
-def security_decrypt_data(encrypted_data, key_id):
+def security_decrypt_data(encrypted_data, key_id=None):
     """Decrypt data"""
     from ai_assistant.core.security import decrypt_data
     result = decrypt_data(encrypted_data, key_id)
     return result
 
 
+@frappe.whitelist()
+def security_encrypt_data_batch(values, key_type="data"):
+    """Encrypt a list of values"""
+    from ai_assistant.core.security import encrypt_data_batch
+
+    if isinstance(values, str):
+        values = json.loads(values)
+
+    result = encrypt_data_batch(values, key_type=key_type)
+    return result
+
+
+@frappe.whitelist()
+def security_decrypt_data_batch(values):
+    """Decrypt a list of values"""
+    from ai_assistant.core.security import decrypt_data_batch
+
+    if isinstance(values, str):
+        values = json.loads(values)
+
+    result = decrypt_data_batch(values)
+    return result
+
+
 @frappe.whitelist()
 def security_rotate_keys(key_type):
     """Rotate encryption keys"""
@@ -490,6 +668,14 @@ def security_rotate_keys(key_type):
     return result
 
 
+@frappe.whitelist()
+def security_get_reencryption_status():
+    """Get re-encryption progress after key rotation"""
+    from ai_assistant.core.security import get_reencryption_status
+    result = get_reencryption_status()
+    return result
+
+
 @frappe.whitelist()
 def security_get_encryption_status():
     """Get encryption status"""
@@ -261,6 +261,291 @@ CREATE TABLE IF NOT EXISTS `oropendola_security_incident` (
   INDEX `idx_assigned_to` (`assigned_to`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- ============================================================================
+-- MIGRATIONS - Incremental changes to the tables above
+-- ============================================================================
+
+-- Secret findings are deduplicated on (file_path, line_number, secret_type,
+-- content hash) so rescans reuse the existing row. The secret value itself is
+-- never stored, only its SHA-256.
+ALTER TABLE `oropendola_secret_detection`
+  ADD COLUMN IF NOT EXISTS `content_hash` VARCHAR(64),
+  ADD COLUMN IF NOT EXISTS `fingerprint` VARCHAR(64),
+  ADD UNIQUE INDEX IF NOT EXISTS `unique_fingerprint` (`fingerprint`);
+
+-- Audit events are written in batches. Each batch is sealed with
+-- SHA-256(prev batch_hash : content_hash), so editing, deleting or reordering
+-- audit rows breaks the chain (see verify_audit_chain).
+ALTER TABLE `oropendola_audit_log`
+  ADD COLUMN IF NOT EXISTS `resource_name` VARCHAR(255),
+  ADD COLUMN IF NOT EXISTS `compliance_relevant` INT(1) NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS `batch_id` VARCHAR(140),
+  ADD INDEX IF NOT EXISTS `idx_batch` (`batch_id`);
+
+CREATE TABLE IF NOT EXISTS `oropendola_audit_batch` (
+  `name` VARCHAR(140) NOT NULL PRIMARY KEY,
+  `creation` DATETIME(6) NOT NULL,
+  `modified` DATETIME(6) NOT NULL,
+  `modified_by` VARCHAR(140),
+  `owner` VARCHAR(140),
+  `docstatus` INT(1) NOT NULL DEFAULT 0,
+  `idx` INT(8) NOT NULL DEFAULT 0,
+
+  `batch_id` VARCHAR(140) UNIQUE NOT NULL,
+  `sequence` BIGINT NOT NULL,
+  `prev_hash` VARCHAR(64) NOT NULL,
+  `content_hash` VARCHAR(64) NOT NULL,
+  `batch_hash` VARCHAR(64) NOT NULL,
+  `event_count` INT NOT NULL,
+  `first_log_id` VARCHAR(140),
+  `last_log_id` VARCHAR(140),
+  `sealed_at` DATETIME(6) NOT NULL,
+
+  UNIQUE INDEX `unique_sequence` (`sequence`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Full-text search over audit logs. search_text holds the action and selected
+-- metadata values (see AUDIT_SEARCH_METADATA_FIELDS) with "_" turned into
+-- spaces, since FULLTEXT treats "_" as a word character. It is filled on write;
+-- the UPDATEs backfill rows written before this migration.
+ALTER TABLE `oropendola_audit_log`
+  ADD COLUMN IF NOT EXISTS `search_text` TEXT;
+
+UPDATE `oropendola_audit_log`
+SET `search_text` = REPLACE(CONCAT_WS(' ',
+  `action`,
+  JSON_UNQUOTE(JSON_EXTRACT(`metadata`, '$.subject')),
+  JSON_UNQUOTE(JSON_EXTRACT(`metadata`, '$.resource')),
+  JSON_UNQUOTE(JSON_EXTRACT(`metadata`, '$.framework')),
+  JSON_UNQUOTE(JSON_EXTRACT(`metadata`, '$.remediation_action')),
+  JSON_UNQUOTE(JSON_EXTRACT(`metadata`, '$.secret_type')),
+  JSON_UNQUOTE(JSON_EXTRACT(`metadata`, '$.incident_id')),
+  JSON_UNQUOTE(JSON_EXTRACT(`metadata`, '$.file_path'))
+), '_', ' ')
+WHERE `search_text` IS NULL;
+
+-- Rows backfilled before search_text carried the action words
+UPDATE `oropendola_audit_log`
+SET `search_text` = REPLACE(CONCAT_WS(' ', `action`, `search_text`), '_', ' ')
+WHERE `search_text` NOT LIKE CONCAT(REPLACE(`action`, '_', ' '), '%');
+
+ALTER TABLE `oropendola_audit_log`
+  ADD FULLTEXT INDEX IF NOT EXISTS `ft_audit_search` (`action`, `resource_name`, `search_text`);
+
+-- Per-user activity baselines for detect_anomaly. Hourly counts are added by
+-- the audit writer; update_activity_baselines folds each completed day into an
+-- EWMA mean/variance and hour-of-day profile. Run rebuild_activity_counts once
+-- after creating these tables to seed them from existing audit rows.
+CREATE TABLE IF NOT EXISTS `oropendola_user_activity_hourly` (
+  `user` VARCHAR(140) NOT NULL,
+  `activity_date` DATE NOT NULL,
+  `activity_hour` TINYINT NOT NULL,
+  `event_count` INT NOT NULL DEFAULT 0,
+
+  PRIMARY KEY (`user`, `activity_date`, `activity_hour`),
+  INDEX `idx_activity_date` (`activity_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `oropendola_user_activity_baseline` (
+  `user` VARCHAR(140) NOT NULL PRIMARY KEY,
+  `baseline_date` DATE NOT NULL,       -- last day folded in
+  `ewma_mean` DOUBLE NOT NULL,         -- actions per day
+  `ewma_var` DOUBLE NOT NULL,
+  `hour_profile` JSON NOT NULL,        -- 24 shares of daily activity
+  `days_observed` INT NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Daily audit rollups maintained by the audit writer, so audit_access and
+-- get_user_activity never aggregate raw audit rows. Run rebuild_audit_rollups
+-- once after creating these tables. action_type '' stands for no action type.
+CREATE TABLE IF NOT EXISTS `oropendola_resource_access_daily` (
+  `resource_type` VARCHAR(100) NOT NULL,
+  `resource_id` VARCHAR(255) NOT NULL,
+  `activity_date` DATE NOT NULL,
+  `user` VARCHAR(140) NOT NULL,
+  `action` VARCHAR(255) NOT NULL,
+  `access_count` INT NOT NULL DEFAULT 0,
+  `last_access` DATETIME(6) NOT NULL,
+
+  PRIMARY KEY (`resource_type`, `resource_id`, `activity_date`, `user`, `action`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `oropendola_user_action_daily` (
+  `user` VARCHAR(140) NOT NULL,
+  `activity_date` DATE NOT NULL,
+  `action_type` VARCHAR(50) NOT NULL DEFAULT '',
+  `action_count` INT NOT NULL DEFAULT 0,
+  `last_activity` DATETIME(6) NOT NULL,
+
+  PRIMARY KEY (`user`, `activity_date`, `action_type`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Subject hierarchy (user -> group/role, group -> group/role) and each user's
+-- materialized effective permissions: one winning ACL rule per
+-- (resource_type, action, resource_id). Maintained by grant_permission,
+-- revoke_permission and the membership functions; seed with
+-- rebuild_effective_permissions.
+CREATE TABLE IF NOT EXISTS `oropendola_subject_membership` (
+  `member_type` VARCHAR(20) NOT NULL,   -- user, group, role
+  `member_id` VARCHAR(140) NOT NULL,
+  `parent_type` VARCHAR(20) NOT NULL,   -- group, role
+  `parent_id` VARCHAR(140) NOT NULL,
+  `created_at` DATETIME(6) NOT NULL,
+
+  PRIMARY KEY (`member_type`, `member_id`, `parent_type`, `parent_id`),
+  INDEX `idx_parent` (`parent_type`, `parent_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `oropendola_effective_permission` (
+  `user` VARCHAR(140) NOT NULL,
+  `resource_type` VARCHAR(100) NOT NULL,
+  `action` VARCHAR(100) NOT NULL,
+  `resource_id` VARCHAR(255) NOT NULL,
+  `acl_id` VARCHAR(140) NOT NULL,
+  `permission` VARCHAR(20) NOT NULL,
+  `priority` INT NOT NULL DEFAULT 0,
+  `via_subject_type` VARCHAR(20) NOT NULL,
+  `via_subject_id` VARCHAR(140) NOT NULL,
+
+  PRIMARY KEY (`user`, `resource_type`, `action`, `resource_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Compliance evidence, counted by the audit writer for compliance-relevant
+-- events: one row per (framework, control, day) with the event count, the
+-- first and last log_id and up to 20 sample log_ids (comma separated) as
+-- references into the audit log. framework/control '*' counts every
+-- compliance-relevant event. Seed with rebuild_compliance_evidence.
+CREATE TABLE IF NOT EXISTS `oropendola_compliance_evidence_daily` (
+  `framework` VARCHAR(50) NOT NULL,
+  `control_id` VARCHAR(50) NOT NULL,
+  `evidence_date` DATE NOT NULL,
+  `event_count` INT NOT NULL DEFAULT 0,
+  `first_log_id` VARCHAR(140),
+  `last_log_id` VARCHAR(140),
+  `sample_log_ids` TEXT,
+
+  PRIMARY KEY (`framework`, `control_id`, `evidence_date`),
+  INDEX `idx_evidence_date` (`evidence_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+ALTER TABLE `oropendola_compliance_evidence_daily`
+  ADD COLUMN IF NOT EXISTS `sample_log_ids` TEXT;
+
+-- The per-event evidence ledger is replaced by the samples above
+DROP TABLE IF EXISTS `oropendola_compliance_evidence`;
+
+-- Incident correlation: repeats of the same (incident_type, resource, content)
+-- inside the correlation window are merged into one open incident and counted
+-- in occurrence_count. Affected users and resources move out of the JSON
+-- columns into the two tables below, keyed by incident name.
+ALTER TABLE `oropendola_security_incident`
+  ADD COLUMN IF NOT EXISTS `fingerprint` VARCHAR(64),
+  ADD COLUMN IF NOT EXISTS `occurrence_count` INT NOT NULL DEFAULT 1,
+  ADD COLUMN IF NOT EXISTS `first_seen_at` DATETIME(6),
+  ADD COLUMN IF NOT EXISTS `last_seen_at` DATETIME(6),
+  ADD INDEX IF NOT EXISTS `idx_fingerprint_seen` (`fingerprint`, `last_seen_at`);
+
+CREATE TABLE IF NOT EXISTS `oropendola_incident_affected_user` (
+  `incident` VARCHAR(140) NOT NULL,
+  `user` VARCHAR(140) NOT NULL,
+  `added_at` DATETIME(6) NOT NULL,
+
+  PRIMARY KEY (`incident`, `user`),
+  INDEX `idx_user` (`user`, `incident`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `oropendola_incident_affected_resource` (
+  `incident` VARCHAR(140) NOT NULL,
+  `resource` VARCHAR(255) NOT NULL,         -- "type:id" or free-form identifier
+  `added_at` DATETIME(6) NOT NULL,
+
+  PRIMARY KEY (`incident`, `resource`),
+  INDEX `idx_resource` (`resource`, `incident`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Backfill from the JSON columns of existing incidents
+INSERT IGNORE INTO `oropendola_incident_affected_user` (`incident`, `user`, `added_at`)
+SELECT i.`name`, j.`user`, i.`creation`
+FROM `oropendola_security_incident` i,
+     JSON_TABLE(i.`affected_users`, '$[*]' COLUMNS (`user` VARCHAR(140) PATH '$')) j
+WHERE j.`user` IS NOT NULL;
+
+INSERT IGNORE INTO `oropendola_incident_affected_resource` (`incident`, `resource`, `added_at`)
+SELECT i.`name`, COALESCE(j.`resource`, CONCAT(j.`resource_type`, ':', j.`event_id`)), i.`creation`
+FROM `oropendola_security_incident` i,
+     JSON_TABLE(i.`affected_resources`, '$[*]' COLUMNS (
+       `resource` VARCHAR(255) PATH '$',
+       `resource_type` VARCHAR(100) PATH '$.type',
+       `event_id` VARCHAR(140) PATH '$.event_id'
+     )) j
+WHERE COALESCE(j.`resource`, CONCAT(j.`resource_type`, ':', j.`event_id`)) IS NOT NULL;
+
+UPDATE `oropendola_security_incident`
+SET `first_seen_at` = COALESCE(`first_seen_at`, `detected_at`),
+    `last_seen_at` = COALESCE(`last_seen_at`, `detected_at`);
+
+-- Incident triage queue: one range scan per (status, severity) lane, newest
+-- first, paged by (reported_at, name). reported_at and incident_number are
+-- written by create_incident; older rows fall back to detected_at / name.
+ALTER TABLE `oropendola_security_incident`
+  ADD COLUMN IF NOT EXISTS `incident_number` VARCHAR(140),
+  ADD COLUMN IF NOT EXISTS `reported_at` DATETIME(6),
+  ADD INDEX IF NOT EXISTS `idx_queue` (`status`, `severity`, `reported_at`, `name`);
+
+UPDATE `oropendola_security_incident`
+SET `reported_at` = COALESCE(`reported_at`, `detected_at`),
+    `incident_number` = COALESCE(`incident_number`, `name`)
+WHERE `reported_at` IS NULL OR `incident_number` IS NULL;
+
+-- The queue has one lane per known severity; record_incidents normalizes
+-- unknown severities to 'medium' on write, and older rows the same way here
+UPDATE `oropendola_security_incident`
+SET `severity` = 'medium'
+WHERE `severity` IS NULL OR `severity` NOT IN ('low', 'medium', 'high', 'critical');
+
+-- Columns record_incidents writes that the original table lacks, and the
+-- open-incident correlation key: open_fingerprint equals fingerprint while the
+-- incident is open and is NULL once it is resolved or ages out of the
+-- correlation window. Its unique key lets concurrent reporters upsert into one
+-- row with INSERT ... ON DUPLICATE KEY UPDATE.
+ALTER TABLE `oropendola_security_incident`
+  ADD COLUMN IF NOT EXISTS `impact` VARCHAR(20) DEFAULT 'medium',
+  ADD COLUMN IF NOT EXISTS `reported_by` VARCHAR(140),
+  ADD COLUMN IF NOT EXISTS `open_fingerprint` VARCHAR(64);
+
+-- Only the latest open incident per fingerprint keeps the key
+UPDATE `oropendola_security_incident` i
+JOIN (
+  SELECT `fingerprint`, MAX(`name`) AS `name`
+  FROM `oropendola_security_incident`
+  WHERE `fingerprint` IS NOT NULL AND `status` IN ('new', 'investigating')
+  GROUP BY `fingerprint`
+) latest ON latest.`name` = i.`name`
+SET i.`open_fingerprint` = i.`fingerprint`
+WHERE i.`open_fingerprint` IS NULL;
+
+ALTER TABLE `oropendola_security_incident`
+  ADD UNIQUE INDEX IF NOT EXISTS `uniq_open_fingerprint` (`open_fingerprint`);
+
+-- Keys written before envelope encryption are metadata rows without wrapped
+-- key material; nothing was ever encrypted under them. Retire them so they are
+-- neither picked as the active data key nor counted as live keys.
+UPDATE `oropendola_encryption_key`
+SET `status` = 'revoked'
+WHERE `status` = 'active'
+  AND `key_type` != 'master'
+  AND (`key_material` IS NULL OR `key_material` = '');
+
+-- Notes columns hold v1 ciphertexts from encrypt_values (registered for lazy
+-- re-encryption in week_12_security_core). Values stored before this change
+-- are plaintext and get encrypted by reencrypt_stale_ciphertexts.
+ALTER TABLE `oropendola_security_incident`
+  ADD COLUMN IF NOT EXISTS `investigation_notes` TEXT,
+  ADD COLUMN IF NOT EXISTS `resolution_notes` TEXT;
+
+ALTER TABLE `oropendola_secret_detection`
+  ADD COLUMN IF NOT EXISTS `remediation_notes` TEXT;
+
 -- ============================================================================
 -- SAMPLE DATA - For testing
 -- ============================================================================